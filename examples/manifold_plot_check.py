@@ -0,0 +1,29 @@
+#
+#   smoke check for neurocode.datautil.manifold_plot, runs both manifold
+#   techniques on random embeddings with random SLEMEG-like labels.
+#   FIt-SNE falls back to sklearn t-SNE if openTSNE is not installed.
+#
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from neurocode.datautil import manifold_plot
+from neurocode.utils import LABEL_DTYPE
+
+rng = np.random.default_rng(73)
+n_samples = 200
+
+embeddings = rng.standard_normal((n_samples, 8)).astype(np.float32)
+labels = np.zeros(n_samples, dtype=LABEL_DTYPE)
+labels['subj_id'] = rng.integers(2, 34, n_samples)
+labels['reco_id'] = rng.integers(0, 4, n_samples)
+labels['gender'] = rng.integers(0, 2, n_samples)
+labels['age'] = rng.integers(20, 40, n_samples)
+for field in ['RTrecipCTR', 'RTrecipPSD', 'RTctr', 'RTpsd', 'RTdiff', 'lapseCTR', 'lapsePSD']:
+    labels[field] = rng.random(n_samples)
+
+for technique in ['tSNE', 'FIt-SNE']:
+    manifold_plot((embeddings, labels), 'train-data_pre', technique=technique, savefig=False)
+    plt.close('all')
+    print(f'manifold_plot with technique={technique} ran successfully')
@@ -6,35 +6,53 @@ Karolinska Institutet (KI) and Stockholm University (SU).
 Authors: Wilhelm Ågren <wagren@kth.se>
 Last edited: 22-02-2022
 """
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
 from braindecode.datasets import BaseConcatDataset, BaseDataset
 from braindecode.datautil.preprocess import preprocess
-from ..utils import DEFAULT_MEG_CHANNELS, fetch_meg_data, load_raw_fif
+from ..utils import DEFAULT_MEG_CHANNELS, LABEL_DTYPE, fetch_meg_data, load_raw_fif
 
 
 class SLEMEG(BaseConcatDataset):
+    """the recordings are always read into memory, since the data has to be
+    accessible. with preload=True and a memmap_dir, or the NEUROCODE_MEMMAP_DIR
+    environment variable, the data is instead memory-mapped to files in that
+    directory to keep RAM usage close to file size. the directory has to be 
+    on disk, memmaps on a tmpfs (often /tmp) still reside in RAM.
+    """
     def __init__(self, subjects=None, recordings=None, preload=False,
-            load_meg_only=True, preprocessors=None, cleaned=False):
+            load_meg_only=True, preprocessors=None, cleaned=False, memmap_dir=None):
         if subjects is None:
             subjects = list(range(2, 34))
         if recordings is None:
             recordings = list(range(0, 4))
 
         super().__init__(self._fetch_and_load(
-            subjects, recordings, preload, load_meg_only, cleaned))
+            subjects, recordings, preload, load_meg_only, cleaned, memmap_dir))
         
         if preprocessors:
             preprocess(self, preprocessors)
 
-    def _fetch_and_load(self, subjects, recordings, preload, load_meg_only, cleaned):
+    def _fetch_and_load(self, subjects, recordings, preload, load_meg_only, cleaned, memmap_dir):
         fpaths = fetch_meg_data(subjects, recordings, cleaned)
         all_base_ds = list()
-        self.labels = list()
-        for subj_id, reco_id, gender, age, RTrecipControl, RTrecipSleep, RTControl, RTSleep, RTdiff, minor_lapses_control, minor_lapses_sleep, path in fpaths:
-            raw, desc = load_raw_fif(
-                    path, subj_id, reco_id, preload, drop_channels=load_meg_only)
+        labels = list()
+
+        # reading the fif files is I/O bound, overlap it in worker threads,
+        # ex.map preserves the order of fpaths for the labels below
+        with ThreadPoolExecutor(max_workers=max(1, min(16, len(fpaths)))) as ex:
+            results = list(ex.map(lambda t: load_raw_fif(
+                t[-1], t[0], t[1], preload, drop_channels=load_meg_only,
+                memmap_dir=memmap_dir), fpaths))
+
+        for (subj_id, reco_id, gender, age, RTrecipControl, RTrecipSleep, RTControl, RTSleep, RTdiff, minor_lapses_control, minor_lapses_sleep, path), (raw, desc) in zip(fpaths, results):
             base_ds = BaseDataset(raw, desc)
             all_base_ds.append(base_ds)
-            self.labels.append((subj_id, reco_id, gender, age, RTrecipControl, RTrecipSleep, RTControl, RTSleep, RTdiff, minor_lapses_control, minor_lapses_sleep))
+            labels.append((int(subj_id), reco_id, gender, age, RTrecipControl, RTrecipSleep, RTControl, RTSleep, RTdiff, minor_lapses_control, minor_lapses_sleep))
 
+        # store labels as one structured array with named fields, such that
+        # label columns can be accessed without iterating over rows
+        self.labels = np.array(labels, dtype=LABEL_DTYPE)
         return all_base_ds
 
@@ -11,6 +11,7 @@ import numpy as np
 
 from functools import partial
 from joblib import Parallel, delayed
+from scipy import signal
 from braindecode.datasets.base import BaseConcatDataset
 
 
@@ -122,3 +123,72 @@ def zscore(X):
     zscored = X - np.mean(X, keepdims=True, axis=-1)
     zscored = zscored / np.std(zscored, keepdims=True, axis=-1)
     return zscored
+
+
+def wavelet_bank(wavelet, widths, n_samples):
+    """func precomputes the wavelet filters used by the Continuous Wavelet
+    Transform (CWT) for all the provided widths, such that the CWT can be
+    computed as one FFT convolution. The filters are the same as those used
+    in scipy.signal.cwt, zero-padded to a common length such that the 
+    `same` mode convolution is aligned identically for every width.
+
+    Parameters
+    ----------
+    wavelet: function
+        The mother wavelet function, e.g. scipy.signal.ricker, called
+        with the two arguments (length, width).
+    widths: np.array | list
+        The widths/scales to compute the wavelet filters for.
+    n_samples: int
+        The number of samples of the signals that are to be transformed,
+        an upper bound on the length of the wavelet filters.
+
+    Returns
+    -------
+    bank: np.array
+        The wavelet filter bank, of shape (len(widths), L) where L is the
+        length of the longest wavelet filter.
+
+    """
+    lengths = [int(np.min([10 * width, n_samples])) for width in widths]
+    size = max(lengths)
+    bank = np.zeros((len(widths), size), dtype=np.complex128 if np.iscomplexobj(
+        wavelet(lengths[0], widths[0])) else np.float64)
+
+    for idx, (width, length) in enumerate(zip(widths, lengths)):
+        # pad such that the filter center matches that of an unpadded filter
+        # in the `same` mode convolution, i.e. (size - 1) // 2 - (length - 1) // 2
+        offset = (size - 1) // 2 - (length - 1) // 2
+        bank[idx, offset:offset + length] = np.conj(wavelet(length, width)[::-1])
+
+    return bank
+
+
+def fft_cwt(x, bank):
+    """func applies the Continuous Wavelet Transform (CWT) to the signal(s) x
+    using a precomputed wavelet filter bank, see wavelet_bank. Equivalent
+    to scipy.signal.cwt, but all widths, and all signals if x is batched, 
+    are convolved in one FFT convolution along the time axis, instead of 
+    one time-domain convolution per width and signal.
+
+    Parameters
+    ----------
+    x: np.array
+        The signal(s) on which to perform the CWT, of shape (n_samples, )
+        or batched with shape (n_signals, n_samples).
+    bank: np.array
+        The wavelet filter bank of shape (n_widths, L), from wavelet_bank.
+
+    Returns
+    -------
+    cwt: np.array
+        The scalogram(s) of shape (n_widths, n_samples), or shape 
+        (n_signals, n_widths, n_samples) if x was batched.
+
+    """
+    x = np.asarray(x)
+    batch_shape = x.shape[:-1]
+    # broadcast x explicitly, `same` mode crops to the shape of the first input
+    x = np.broadcast_to(x[..., None, :], (*batch_shape, bank.shape[0], x.shape[-1]))
+    bank = bank.reshape((1, ) * len(batch_shape) + bank.shape)
+    return signal.fftconvolve(x, bank, mode='same', axes=-1)
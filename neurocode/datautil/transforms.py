@@ -49,9 +49,8 @@ class BaseTransform(object):
 class CropResizeTransform(BaseTransform):
     """data augmentation module T for the SimCLR pipeline, applying
     the Crop&Resize transform to a given input data x, retaining 
-    the dimensionalities. Supports multi-channel data, but might
-    have slower execution times since the transform has to be 
-    applied to each channel individually (?)...
+    the dimensionalities. Supports multi-channel data, all channels
+    are resampled at once along the time axis.
 
     Inherits from the BaseTransform object that defines the outlining
     functions for the transform.
@@ -127,10 +126,9 @@ class CropResizeTransform(BaseTransform):
             # out, instead of using it. this choice remains for ALL channels in x.
             choice = np.random.choice(indices)
             start, end = [np.ceil((choice + i) * size).astype(int) for i in [0,1]]
-            resampled = np.zeros(x.shape).astype(x.dtype)
 
-            for channel in range(n_channels):
-                resampled[channel, :] = signal.resample(x[channel, start:end], n_samples)
+            # resample all channels at once along the time axis
+            resampled = signal.resample(x[:, start:end], n_samples, axis=-1).astype(x.dtype)
             
             return resampled
         
@@ -199,15 +197,9 @@ class PermutationTransform(BaseTransform):
         size = n_samples // partitions
         indices = np.random.permutation(partitions)
 
-        # get the partitioning indices based on the input size and permuted base indices
-        samples = [(np.ceil(i * size).astype(int), np.ceil((i + 1) * size).astype(int)) for i in indices]
-        permuted = np.zeros(x.shape).astype(x.dtype)
-
-        # apply the permutation on all channels of x, according to above shuffling
-        for channel in range(n_channels):
-            for idx, (start, end) in enumerate(samples):
-                nstart, nend = [np.ceil((idx + i) * size).astype(int) for i in [0,1]]
-                permuted[channel, nstart:nend] = x[channel, start:end]
+        # view x as (n_channels, partitions, size) and apply the permutation on 
+        # all channels at once, fancy indexing makes sure that x is not modified
+        permuted = x.reshape(n_channels, partitions, size)[:, indices].reshape(x.shape)
         
         return permuted
 
@@ -7,20 +7,35 @@ Authors: Wilhelm Ågren <wagren@kth.se>
 Last edited: 22-02-2022
 """
 from typing_extensions import runtime_checkable
+import hashlib
+import warnings
 import numpy as np
 import matplotlib.pyplot as plt
 
 from sklearn.manifold import TSNE
-from ..utils import RECORDING_ID_MAP
+from ..utils import RECORDING_ID_MAP, to_label_array
 
+try:
+    # optional dependency, FFT-accelerated interpolation based t-SNE
+    # (FIt-SNE, Linderman et al. 2019), falls back to sklearn otherwise
+    import openTSNE
+except ImportError:
+    openTSNE = None
 
-def manifold_plot(X, title, technique='tSNE', n_components=2, perplexity=30.0, savefig=True):
+# memoized manifold components, keyed on a digest of the embeddings together
+# with the reducer parameters, such that repeated calls are not recomputed
+_TSNE_CACHE = {}
+
+
+def manifold_plot(X, title, technique='FIt-SNE', n_components=2, perplexity=30.0, 
+        savefig=True, max_points=5000):
     """func applies the non-linear dimensionality reduction technique t-SNE
     to the provided embeddings. X is a tuple containing both the list of
     embddings and list of labels, which are of the form:
     
     >>> embeddings, labels = X
-    >>> labels = [(subj_id, reco_id, gender, age), ...]
+    >>> labels = [(subj_id, reco_id, gender, age, RTrecipCTR, RTrecipPSD,
+    ...     RTctr, RTpsd, RTdiff, lapseCTR, lapsePSD), ...]
 
     After applying t-SNE and transforming the embeddings to cartesian space,
     clamps ALL labels accordingly. Specify saving the plots with
@@ -36,13 +51,21 @@ def manifold_plot(X, title, technique='tSNE', n_components=2, perplexity=30.0, s
     Parameters
     ----------
     X: tuple
-        Contains two items (np.array, list) where the np.array is 
-        a collection of extracted embeddings and the list are the
-        respective embedding labels. 
+        Contains two items (np.array, list | np.array) where the first
+        np.array is a collection of extracted embeddings and the second
+        item holds the respective embedding labels, preferably as a 
+        structured array with the fields of neurocode.utils.LABEL_DTYPE.
     title: str
         Used for the plots, usually either `before` or `after` to 
         specify if embeddings where extracted prior- or post-
         training. 
+    technique: str
+        The manifold learning technique to use, either `FIt-SNE` or
+        `tSNE`. FIt-SNE requires openTSNE to be installed, and is 
+        substantially faster for large amounts of embeddings since
+        the repulsive forces are approximated with FFT convolutions
+        on an interpolation grid. Falls back to the sklearn `tSNE`
+        implementation, with a warning, if openTSNE is not available.
     n_components: int | float
         Specifier for number of dimensions to reduce embeddings to,
         by means of t-SNE. Since we want a 2D plot, almost always,
@@ -54,59 +77,72 @@ def manifold_plot(X, title, technique='tSNE', n_components=2, perplexity=30.0, s
        Saves the produced plots if true, filenames are based on 
        subject labels that the plot represents and based on title
        arg as well. 
+    max_points: int | None
+       The maximum number of points to plot, if there are more embeddings
+       than this then a fixed random subset of the transformed embeddings
+       is plotted. Set to None to plot all points.
 
     For more information on manifold learning, see sklearn.manifold 
     documentation for t-SNE, or see the original paper.
     """
-    from IPython.display import set_matplotlib_formats
-    #set_matplotlib_formats('svg')
     #plt.style.use('seaborn')
     #plt.rcParams['figure.dpi'] = 300
     #plt.rcParams['savefig.dpi'] = 300
     embeddings, Y = X
+    embeddings = np.ascontiguousarray(embeddings)
+    digest = hashlib.blake2b(embeddings.view(np.uint8), digest_size=16).digest()
     __manifolds__ = {
-        'tSNE': TSNE(n_components=n_components, perplexity=perplexity)
+        'tSNE': lambda x: TSNE(n_components=n_components, perplexity=perplexity,
+            n_jobs=-1).fit_transform(x)
     }
 
-    reducer = __manifolds__[technique]
-    components = reducer.fit_transform(embeddings)
+    if openTSNE is not None:
+        __manifolds__['FIt-SNE'] = lambda x: openTSNE.TSNE(n_components=n_components, 
+                perplexity=perplexity, neighbors='annoy', negative_gradient_method='fft',
+                n_jobs=-1).fit(x)
+    elif technique == 'FIt-SNE':
+        warnings.warn('openTSNE is not installed, falling back to sklearn t-SNE for '
+                '`FIt-SNE`. Install openTSNE for FFT-accelerated t-SNE.')
+        technique = 'tSNE'
+
+    key = (digest, embeddings.shape, embeddings.dtype.str, n_components, perplexity, technique)
+    if key not in _TSNE_CACHE:
+        reducer = __manifolds__[technique]
+        # copy, np.asarray of an openTSNE embedding is a view that would keep the
+        # affinities and optimizer state alive, only cache the components
+        _TSNE_CACHE[key] = np.array(reducer(embeddings), copy=True)
+    components = _TSNE_CACHE[key]
     #plt.rc('font', size=18)
     #plt.rc('axes', titlesize=18)
     # set up the clamping of labels, requires the labels to be stored in numpy
     # arrays from now one, since we want to do masking on the transformed 
     # embedding components. this ultimately makes it so we only have to iterate
-    # over the different classes instead of each point.
-    n_samples = len(Y)
+    # over the different classes instead of each point. labels are accessed
+    # as fields of one structured array, no per-sample loop needed.
+    Y = to_label_array(Y)
+
+    # rendering is python-level per point in matplotlib, so uniformly at random
+    # subsample the points to plot, the t-SNE structure is visually retained
+    if max_points and len(Y) > max_points:
+        idxs = np.sort(np.random.default_rng(0).choice(len(Y), max_points, replace=False))
+        components = components[idxs]
+        Y = Y[idxs]
+
     labels = {
-            'sleep': np.ones((n_samples, )),
-            'eyes': np.ones((n_samples, )),
-            'recording': np.ones((n_samples, )),
-            'gender': np.ones((n_samples, )),
-            'age': np.ones((n_samples, )),
-            'RTrecipCTR': np.ones((n_samples, )),
-            'RTrecipPSD': np.ones((n_samples, )),
-            'RTctr': np.ones((n_samples, )),
-            'RTpsd': np.ones((n_samples, )),
-            'RTdiff': np.ones((n_samples, )),
-            'lapseCTR': np.ones((n_samples, )),
-            'lapsePSD': np.ones((n_samples, ))
+            'sleep': Y['reco_id'] // 2,
+            'eyes': Y['reco_id'] % 2,
+            'recording': Y['reco_id'],
+            'gender': Y['gender'],
+            'age': Y['age'],
+            'RTrecipCTR': Y['RTrecipCTR'],
+            'RTrecipPSD': Y['RTrecipPSD'],
+            'RTctr': Y['RTctr'],
+            'RTpsd': Y['RTpsd'],
+            'RTdiff': Y['RTdiff'],
+            'lapseCTR': Y['lapseCTR'],
+            'lapsePSD': Y['lapsePSD']
             }
 
-    for idx, (subj_id, reco_id, gender, age, RTrecipCTR, RTrecipPSD,
-    RTctr, RTpsd, RTdiff, minor_lapses_ctr, minor_lapses_psd) in enumerate(Y):
-        labels['sleep'][idx] = int(reco_id // 2)
-        labels['eyes'][idx] = int(reco_id % 2)
-        labels['recording'][idx] = int(reco_id)
-        labels['gender'][idx] = int(gender)
-        labels['age'][idx] = int(age)
-        labels['RTrecipCTR'][idx] = RTrecipCTR
-        labels['RTrecipPSD'][idx] = RTrecipPSD
-        labels['RTctr'][idx] = RTctr
-        labels['RTpsd'][idx] = RTpsd
-        labels['RTdiff'][idx] = RTdiff
-        labels['lapseCTR'][idx] = minor_lapses_ctr
-        labels['lapsePSD'][idx] = minor_lapses_psd
-
     unique_labels = {
             'sleep': [0, 1],
             'eyes': [0, 1],
@@ -155,20 +191,32 @@ def manifold_plot(X, title, technique='tSNE', n_components=2, perplexity=30.0, s
 
     for cls in labels:
         fig, ax = plt.subplots()
-        colors = [plt.cm.Spectral(each) for each in np.linspace(0, 1, len(unique_labels[cls]))]
         if cls in reactiontimes_:
             colors = labels[cls]
             sc = ax.scatter(components[:, 0], components[:, 1],
              c=colors[:], cmap=plt.cm.coolwarm, alpha=.8, s=5.)
             plt.colorbar(sc)
         else:
-            for idx, (k, col) in enumerate(zip(unique_labels[cls], colors)):
-                class_mask = labels[cls] == k
-                xy = components[class_mask]
-                ax.scatter(xy[:, 0], xy[:, 1], alpha=.8, s=5., label=unique_ll[cls][idx])
+            # (n_classes, 4) RGBA array from one colormap call
+            colors = plt.cm.Spectral(np.linspace(0, 1, len(unique_labels[cls])))
+            # assign each point its class in one pass, then gather per class,
+            # instead of one full equality scan of the labels per class k
+            uniq, inv = np.unique(labels[cls], return_inverse=True)
+            indices = np.searchsorted(unique_labels[cls], uniq)
+            # values that are not one of the known classes are skipped
+            known = np.isin(uniq, unique_labels[cls])
+            for i, k in enumerate(uniq):
+                if not known[i]:
+                    continue
+                xy = components[inv == i]
+                ax.scatter(xy[:, 0], xy[:, 1], alpha=.8, s=5., color=colors[indices[i]],
+                        label=unique_ll[cls][indices[i]])
         handles, lbls = ax.get_legend_handles_labels()
-        uniques = [(h, l) for i, (h, l) in enumerate(zip(handles, lbls)) if l not in lbls[:i]]
-        ax.legend(*zip(*uniques))
+        uniques = {}
+        for h, l in zip(handles, lbls):
+            uniques.setdefault(l, h)
+        if uniques:
+            ax.legend(uniques.values(), uniques.keys())
         fig.suptitle(f't-SNE of features, subject {cls}, {realtitle} training')
         if savefig:
             plt.savefig(f't-SNE_{cls}_{title}-training.png')
@@ -13,6 +13,54 @@ from collections import defaultdict
 from ..datasets import RecordingDataset
 
 
+class StagingBuffers(object):
+    """two reusable host buffers of shape (batch_size, *shape), pinned if the
+    device is CUDA, through which batches of items are copied to the device.
+    The host-to-device copy of a batch is asynchronous, so filling the next
+    batch on the host overlaps with the forward pass of the current one on
+    the device. A buffer is only refilled once its previous copy finished.
+
+    Attributes
+    ----------
+    shape: tuple
+        The shape of one item, e.g. (C, T) for a signal window.
+    batch_size: int
+        The maximum number of items per batch.
+    device: torch.device | str
+        The device to copy the batches to.
+    dtype: torch.dtype
+        The dtype of the host buffers, items are cast on assignment.
+
+    """
+    def __init__(self, shape, batch_size, device, dtype=torch.float32):
+        self.device = device
+        self.pin_memory = torch.device(device).type == 'cuda'
+        self.buffers = [torch.empty((batch_size, *shape), dtype=dtype,
+            pin_memory=self.pin_memory) for _ in range(2)]
+        self.events = [None, None]
+        self.batch_size = batch_size
+
+    def batches(self, items, transform=None):
+        for batch, start in enumerate(range(0, len(items), self.batch_size)):
+            chunk = items[start:start + self.batch_size]
+            k = batch % 2
+            if self.events[k] is not None:
+                self.events[k].synchronize()
+
+            staging = self.buffers[k][:len(chunk)]
+            for idx, item in enumerate(chunk):
+                item = transform(item) if transform else item
+                staging[idx] = torch.from_numpy(item) if isinstance(item, np.ndarray) else item
+
+            batch = staging.to(self.device, non_blocking=self.pin_memory)
+            if self.pin_memory:
+                # marks when the copy out of buffer k has finished
+                self.events[k] = torch.cuda.Event()
+                self.events[k].record()
+
+            yield batch
+
+
 class PretextSampler(Sampler):
     def __init__(self, data, labels, info, **kwargs):
         self.data = data
@@ -34,6 +82,8 @@ class PretextSampler(Sampler):
         self.n_samples = n_samples
         self.batch_size = batch_size
         self.presample = presample
+        self._lens = np.array([self.info['lengths'][recording] 
+            for recording in range(self.info['n_recordings'])])
 
         if presample:
             self._presample()
@@ -73,6 +123,15 @@ class PretextSampler(Sampler):
         if recording_idx is None:
             recording_idx = self._sample_recording()
         return self.rng.choice(self.info['lengths'][recording_idx])
+
+    def _sample_windows(self, n_windows):
+        """sample n (recording, window) index pairs at once, with the same
+        distribution as calling _sample_recording and _sample_window n times, 
+        but using one vectorized random draw each instead of 2n python calls.
+        """
+        reco_ids = self.rng.randint(0, high=self.info['n_recordings'], size=n_windows)
+        wind_ids = self.rng.randint(0, high=self._lens[reco_ids])
+        return (reco_ids, wind_ids)
    
     def _sample_pair(self, *args, **kwargs):
         raise NotImplementedError(
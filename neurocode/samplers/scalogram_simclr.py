@@ -31,7 +31,9 @@ import matplotlib.pyplot as plt
 from PIL import Image
 from scipy import signal as sig
 from torchvision import transforms
-from .base import PretextSampler
+from .base import PretextSampler, StagingBuffers
+from ..utils import to_label_array
+from ..datautil import wavelet_bank, fft_cwt
 
 
 class ContrastiveViewGenerator(object):
@@ -107,6 +109,8 @@ class ScalogramSampler(PretextSampler):
         
         self.widths = np.arange(1, widths + 1)
         self.signal = sig.ricker
+        self._wavelet_bank = wavelet_bank(self.signal, self.widths,
+                self.data[0][0][0].shape[-1])
         self.n_views = n_views
         shape = shape[1:]
         self.shape = shape
@@ -155,7 +159,7 @@ class ScalogramSampler(PretextSampler):
             wind_idx = self._sample_window(recording_idx=reco_idx)
 
             x = self.data[reco_idx][wind_idx][0]
-            scalogram = sig.cwt(x.squeeze(0), self.signal, self.widths)
+            scalogram = fft_cwt(x.squeeze(0), self._wavelet_bank)
             scalogram = ((scalogram - scalogram.min()) * (1/(scalogram.max() - scalogram.min()) * 255)).astype('uint8')
             image = Image.fromarray(scalogram)
             T1, T2 = self.transformer(image)
@@ -192,8 +196,8 @@ class ScalogramSampler(PretextSampler):
 
         return (ANCHORS, SAMPLES)
 
-    def _extract_features(self, model, device):
-        """sample every 200th window from each recording
+    def _extract_features(self, model, device, batch_size=256):
+        """sample every 20th window from each recording
         and extract the f() features of the window.
         make sure that the corresponding labels are 'sampled'
         pairwise to the features, such that the tSNE plots 
@@ -211,6 +215,9 @@ class ScalogramSampler(PretextSampler):
         device: str | torch.device
             the device on which to perform feature extraction,
             should be the same as that of the model.
+        batch_size: int
+            the number of scalograms to feed to the model in each
+            forward pass. lower this if you run out of memory.
 
         Returns
         -------
@@ -226,7 +233,10 @@ class ScalogramSampler(PretextSampler):
             has to be the same length as X.
 
         """
-        X, Y = [], []
+        X, Y = None, []
+        offset = 0
+        n_total = sum(int(np.ceil(len(self.data[recording]) / 20)) for recording in range(len(self.data)))
+        staging = StagingBuffers((1, *self.shape), batch_size, device)
         model.eval()
         model._return_features = True
         resize_transform = transforms.Compose([
@@ -235,15 +245,27 @@ class ScalogramSampler(PretextSampler):
 
         with torch.no_grad():
             for recording in range(len(self.data)):
-                for window in range(len(self.data[recording])):
-                    if window % 20 == 0:
-                        window = self.data[recording][window][0]
-                        matrix = sig.cwt(window.squeeze(0), self.signal, self.widths)
-                        matrix = resize_transform(matrix).to(device)
-                        feature = model(matrix.unsqueeze(0).float())
-                        X.append(feature[0, :][None])
-                        Y.append(self.labels[recording])
-        X = np.concatenate([x.cpu().detach().numpy() for x in X], axis=0)
+                # stack the windows of the recording and compute all of
+                # their scalograms in one batched FFT convolution
+                windows = np.stack([self.data[recording][window][0].squeeze(0)
+                        for window in range(0, len(self.data[recording]), 20)])
+                matrices = fft_cwt(windows, self._wavelet_bank)
+                for batch in staging.batches(matrices, transform=resize_transform):
+                    features = model(batch)
+                    if X is None:
+                        # preallocate features on the model device, one
+                        # device-to-host copy at the end instead of one per batch
+                        X = torch.empty((n_total, features.shape[1]),
+                                dtype=features.dtype, device=features.device)
+                    X[offset:offset + features.shape[0]] = features
+                    offset += features.shape[0]
+                label = to_label_array(self.labels[recording])
+                if len(label) != 1:
+                    raise ValueError(
+                        f'Expected one label for recording {recording}, got {len(label)}.')
+                Y.append(np.repeat(label, len(matrices)))
+        X = X.cpu().numpy()
+        Y = np.concatenate(Y, axis=0)
         model._return_features = False
         model.train()
 
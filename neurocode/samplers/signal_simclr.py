@@ -21,7 +21,8 @@ Last edited: 14-02-2022
 import torch
 import numpy as np
 
-from .base import PretextSampler
+from .base import PretextSampler, StagingBuffers
+from ..utils import to_label_array
 from ..datautil import CropResizeTransform, PermutationTransform, AmplitudeScaleTransform, ZeroMaskingTransform
 
 
@@ -47,7 +48,10 @@ class ContrastiveViewGenerator(object):
         self.n_views = n_views
     
     def __call__(self, x):
-        return [torch.Tensor(self.transforms[t](x)) for t in range(self.n_views)]
+        # torch.from_numpy shares memory with the transformed array, so only
+        # cast when the transform did not already produce contiguous float32
+        return [torch.from_numpy(np.ascontiguousarray(self.transforms[t](x), 
+            dtype=np.float32)) for t in range(self.n_views)]
 
 
 class SignalSampler(PretextSampler):
@@ -109,15 +113,17 @@ class SignalSampler(PretextSampler):
             Same as above, but second transformation was applied to the original
             signal S(t). See neurocode.datautil.transforms for documentation.
         """
-        batch_anchors = list()
-        batch_samples = list()
-        for _ in range(self.batch_size):
-            reco_idx = self._sample_recording()
-            wind_idx = self._sample_window(recording_idx=reco_idx)
-
+        ANCHORS, SAMPLES = None, None
+        reco_ids, wind_ids = self._sample_windows(self.batch_size)
+        for i, (reco_idx, wind_idx) in enumerate(zip(reco_ids, wind_ids)):
             x = self.data[reco_idx][wind_idx][0]
             T1, T2 = self.transformer(x)
 
+            if ANCHORS is None:
+                # infer (C, T) from the first view and allocate the batches once
+                ANCHORS = torch.empty((self.batch_size, 1, *T1.shape), dtype=T1.dtype)
+                SAMPLES = torch.empty_like(ANCHORS)
+
             """
             import matplotlib.pyplot as plt
             plt.style.use('seaborn')
@@ -132,19 +138,18 @@ class SignalSampler(PretextSampler):
             plt.show()
             """
 
-            batch_anchors.append(T1.unsqueeze(0))
-            batch_samples.append(T2.unsqueeze(0))
-
-        ANCHORS = torch.cat(batch_anchors).unsqueeze(1)
-        SAMPLES = torch.cat(batch_samples).unsqueeze(1)
+            ANCHORS[i, 0] = T1
+            SAMPLES[i, 0] = T2
 
         return (ANCHORS, SAMPLES)
 
-    def _extract_features(self, model, device):
+    def _extract_features(self, model, device, batch_size=256, stride=25):
         """heuristically sample windows from each
         recording and use f() to extract features. 
         Labels are pairwise sampled to the corresponding
         features, otherwise the tSNE plots are useless.
+        All windows of a recording are stacked and fed
+        to f() in batches, instead of one at a time.
 
         Parameters
         ----------
@@ -161,6 +166,12 @@ class SignalSampler(PretextSampler):
             The device on which to perform feature extraction, either
             CPU, CUDA or some GPU:0...N, should be the same as that 
             of the provided model.
+        batch_size: int
+            The number of windows to feed to the model in each
+            forward pass. Lower this if you run out of memory.
+        stride: int
+            Only every stride:th window of each recording is used
+            for feature extraction, set to 1 to use all windows.
 
         Returns
         -------
@@ -176,18 +187,37 @@ class SignalSampler(PretextSampler):
             has to be the same length as X.
 
         """
-        X, Y = [], []
+        X, Y = None, []
+        offset = 0
+        n_total = sum(len(range(0, len(self.data[recording]), stride)) for recording in range(len(self.data)))
+        staging = None
         model.eval()
         model._return_features = True
         with torch.no_grad():
             for recording in range(len(self.data)):
-                for window in range(len(self.data[recording])):
-                    if window % 1 == 0:
-                        window = torch.Tensor(self.data[recording][window][0][None]).float().to(device)
-                        feature = model(window.unsqueeze(0))
-                        X.append(feature[0, :][None])
-                        Y.append(*self.labels[recording])
-        X = np.concatenate([x.cpu().detach().numpy() for x in X], axis=0)
+                indices = range(0, len(self.data[recording]), stride)
+                n_windows = len(indices)
+                if staging is None:
+                    # reusable (pinned) batch buffers, filling the next batch
+                    # on the host overlaps with the forward pass on the device
+                    staging = StagingBuffers(self.data[recording][0][0].shape, batch_size, device)
+                windows = [self.data[recording][window][0] for window in indices]
+                for batch in staging.batches(windows):
+                    features = model(batch.unsqueeze(1))
+                    if X is None:
+                        # preallocate features on the model device, results in one
+                        # device-to-host copy at the end instead of one per batch
+                        X = torch.empty((n_total, features.shape[1]), 
+                                dtype=features.dtype, device=features.device)
+                    X[offset:offset + features.shape[0]] = features
+                    offset += features.shape[0]
+                label = to_label_array(self.labels[recording])
+                if len(label) != 1:
+                    raise ValueError(
+                        f'Expected one label for recording {recording}, got {len(label)}.')
+                Y.append(np.repeat(label, n_windows))
+        X = X.cpu().numpy()
+        Y = np.concatenate(Y, axis=0)
         model._return_features = False
 
         return (X, Y)
@@ -6,7 +6,11 @@ Last edited: 22-02-2022
 """
 import mne
 import os
+import atexit
+import tempfile
+import threading
 import torch
+import numpy as np
 import pandas as pd
 
 
@@ -273,11 +277,43 @@ RELATIVE_LABEL_PATH = os.path.join(__root__, 'data/subjects.tsv')
 RELATIVE_MEG_PATH = os.path.join(__root__, 'data/data-ds-200Hz/')
 RELATIVE_CLEANED_MEG_PATH = os.path.join(__root__, 'data/data-cleaned/')
 DEFAULT_MEG_CHANNELS = ['MEG2121', 'MEG2131', 'MEG2141'] # ['MEG1431', 'MEG2611', 'MEG2621'] #['MEG2121', 'MEG2131', 'MEG2141'] # ['MEG0711', 'MEG0721', 'MEG0731'] # ['MEG2121', 'MEG2131', 'MEG2141'] #, 'MEG2342', 'MEG2343']
+MEMMAP_DIR = os.environ.get('NEUROCODE_MEMMAP_DIR')   # disk-backed memmap directory, None -> no memmapping
 RECORDING_ID_MAP = {
         0: 'ses-con_task-rest_ec',
         1: 'ses-con_task-rest_eo',
         2: 'ses-psd_task-rest_ec',
         3: 'ses-psd_task-rest_eo'}
+LABEL_DTYPE = np.dtype([
+        ('subj_id', 'i4'),
+        ('reco_id', 'i4'),
+        ('gender', 'i4'),
+        ('age', 'i4'),
+        ('RTrecipCTR', 'f4'),
+        ('RTrecipPSD', 'f4'),
+        ('RTctr', 'f4'),
+        ('RTpsd', 'f4'),
+        ('RTdiff', 'f4'),
+        ('lapseCTR', 'f4'),
+        ('lapsePSD', 'f4')])
+
+def to_label_array(labels):
+    """func casts labels to a structured array of LABEL_DTYPE, shape (n, ).
+    Accepts structured arrays or records, a single label given as a tuple
+    or numeric vector of the 11 label values, or a collection of such labels.
+    """
+    if isinstance(labels, (np.ndarray, np.void)) and labels.dtype.names:
+        return np.asarray(labels, dtype=LABEL_DTYPE).reshape(-1)
+
+    if len(labels) == 0:
+        return np.empty((0, ), dtype=LABEL_DTYPE)
+
+    # a single label is a flat sequence of scalars, otherwise a sequence of rows
+    rows = labels
+    if not isinstance(labels[0], np.void) and np.ndim(labels[0]) == 0:
+        rows = [labels]
+
+    return np.array([tuple(float(value) for value in (row.item() if isinstance(row, np.void) else row))
+        for row in rows], dtype=LABEL_DTYPE)
 
 def recording_train_valid_split(recordings, split=.6):
     split_idx = int(len(recordings) * split)
@@ -293,8 +329,46 @@ def BCEWithLogitsAccuracy(outputs, labels):
     outputs = outputs > 0.
     return (outputs == labels).sum().item()
 
-def load_raw_fif(fpath, subj_id, reco_id, preload, drop_channels=False):
-    raw = mne.io.read_raw_fif(fpath, preload=True)   # we need to preload, otherwise can't access data
+_memmap_files = []
+_memmap_lock = threading.Lock()   # recordings are loaded from a thread pool
+
+def _cleanup_memmaps():
+    for fpath in _memmap_files:
+        try:
+            os.remove(fpath)
+        except OSError:
+            pass
+
+def _memmap_path(fpath, directory):
+    """func creates a unique memmap file for the recording in the given 
+    directory, outside of the data directories. all created files are
+    removed on exit.
+    """
+    with _memmap_lock:
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.splitext(os.path.basename(fpath))[0] + '_'
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix='_memmap.dat', dir=directory)
+        os.close(fd)
+        _memmap_files.append(path)
+    return path
+
+atexit.register(_cleanup_memmaps)
+
+def load_raw_fif(fpath, subj_id, reco_id, preload, drop_channels=False, memmap_dir=None):
+    """func reads the raw fif recording, always preloading the data since it 
+    has to be accessible. memory-mapping only happens when preload is True 
+    and a memmap directory is given, either as memmap_dir or through the 
+    NEUROCODE_MEMMAP_DIR environment variable, otherwise the data is read
+    onto the heap. the directory has to be disk-backed, memmaps on a tmpfs,
+    which /tmp often is, still reside in RAM.
+    """
+    memmap_dir = memmap_dir or MEMMAP_DIR
+    if preload is True and memmap_dir:
+        # memory-map the data to a file outside of the data directories, instead
+        # of reading all of it onto the heap, keeps RAM usage close to file size
+        preload = _memmap_path(fpath, memmap_dir)
+
+    raw = mne.io.read_raw_fif(fpath, preload=preload or True)   # we need to preload, otherwise can't access data
     
     if drop_channels:
         exclude = list(ch for ch in list(map(lambda ch: None if ch in DEFAULT_MEG_CHANNELS else ch, raw.info['ch_names'])) if ch)
@@ -365,7 +439,8 @@ def fetch_meg_data(subjects, recordings, cleaned):
     megpath = RELATIVE_CLEANED_MEG_PATH if cleaned else RELATIVE_MEG_PATH
     included_files = []
     subject_ids = pad_and_stringify(subjects, 2)
-    files = [os.path.join(megpath, f) for f in list(os.listdir(megpath)) if get_subject_id(f) in subject_ids]
+    files = [os.path.join(megpath, f) for f in list(os.listdir(megpath))
+            if f.endswith('.fif') and get_subject_id(f) in subject_ids]
     for f in files:
         for recording in recordings:
             if RECORDING_ID_MAP[recording] in f: